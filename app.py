@@ -1,9 +1,60 @@
 import os
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, Response
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
-import uuid
+from functools import lru_cache
+import itertools
+import mimetypes
+import shutil
 import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Try to import OpenCV with fallback
+try:
+    import cv2
+    import numpy as np
+    opencv_available = True
+except ImportError:
+    opencv_available = False
+    print("OpenCV not available, reading images from disk")
+
+# Prefer blake3 for content hashing, fall back to stdlib sha256
+try:
+    from blake3 import blake3 as new_hasher
+except ImportError:
+    from hashlib import sha256 as new_hasher
+
+# Try to import orjson for faster response serialization with fallback
+try:
+    import orjson
+    from flask.json.provider import JSONProvider
+
+    class OrjsonProvider(JSONProvider):
+        # orjson emits bytes directly and serializes numpy scalars
+        # (e.g. corrosion percentages) without a tolist() round-trip
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    orjson_available = True
+except ImportError:
+    orjson_available = False
+    print("orjson not available, using the default JSON encoder")
+
+# Try to import the streaming multipart parser with fallback
+try:
+    from streaming_form_data import StreamingFormDataParser
+    from streaming_form_data.targets import ValueTarget
+    streaming_parser_available = True
+except ImportError:
+    streaming_parser_available = False
+    print("streaming-form-data not available, using werkzeug parser")
 
 # Try to import Supabase with fallback
 try:
@@ -13,9 +64,9 @@ except ImportError:
     supabase_available = False
     print("Supabase client not available, using mock implementation")
 
-# Try to import Ultralytics with fallback
+# Try to import the detector with fallback
 try:
-    from ultralytics import YOLO
+    from utils.detection import CorrosionDetector
     yolo_available = True
 except ImportError:
     yolo_available = False
@@ -23,7 +74,19 @@ except ImportError:
 
 load_dotenv()
 
+# IDs only need to be unique, so read urandom once per process and lay a
+# timestamp-seeded counter out as a UUID instead of paying a syscall and
+# uuid4 formatting on every request (the columns stay uuid-typed)
+_id_prefix = os.urandom(8).hex()
+_id_counter = itertools.count(int(time.time() * 1000) << 20)
+
+def new_id():
+    raw = _id_prefix + f"{next(_id_counter) & 0xffffffffffffffff:016x}"
+    return f"{raw[:8]}-{raw[8:12]}-{raw[12:16]}-{raw[16:20]}-{raw[20:32]}"
+
 app = Flask(__name__)
+if orjson_available:
+    app.json = OrjsonProvider(app)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['PROCESSED_FOLDER'] = 'processed'
@@ -46,31 +109,27 @@ if supabase_available:
 
 # Create mock database client if Supabase isn't available
 if not supabase_available:
+    MOCK_RESULT = type('MockResult', (), {'data': [{'id': 'mock'}]})()
+
     class MockDB:
-        def table(self, name):
-            return self
-        
-        def insert(self, data):
-            return self
-        
-        def update(self, data):
+        # Every attribute lookup and call in a fluent chain returns the
+        # same instance, so .table().insert().eq().execute() allocates
+        # nothing and ends at a constant result
+        def __getattr__(self, name):
             return self
-        
-        def eq(self, key, value):
+
+        def __call__(self, *args, **kwargs):
             return self
-        
+
         def execute(self):
-            class MockResult:
-                def __init__(self):
-                    self.data = [{'id': str(uuid.uuid4())}]
-            return MockResult()
-    
+            return MOCK_RESULT
+
     db = MockDB()
 
 # Initialize detector with error handling
 if yolo_available:
     try:
-        detector = YOLO('best.pt')
+        detector = CorrosionDetector('best.pt')
         print("YOLO model loaded successfully")
     except Exception as e:
         yolo_available = False
@@ -78,29 +137,166 @@ if yolo_available:
 
 # Create mock detector if YOLO isn't available
 if not yolo_available:
+    class MockDetection:
+        def __init__(self, image_path):
+            self.boxes = None
+            self.path = image_path
+
+        def save(self, path):
+            # Copy the original image as "processed"
+            shutil.copy2(self.path, path)
+
     class MockDetector:
-        def __init__(self, model_path):
-            print(f"Using mock detector with model: {model_path}")
-            pass
-        
         def detect(self, image_path):
-            class MockResult:
-                def __init__(self, image_path):
-                    self.boxes = None
-                    self.path = image_path
-                
-                def save(self, path):
-                    import shutil
-                    # Copy the original image as "processed"
-                    shutil.copy2(self.path, path)
-            
-            return MockResult(image_path)
-        
+            return MockDetection(image_path)
+
         def calculate_corrosion_percentage(self, result):
             # Return a mock value for demonstration
             return 15.7
-    
-    detector = MockDetector('best.pt')
+
+    detector = MockDetector()
+
+# Micro-batch concurrent detections into a single GPU call
+MAX_BATCH = 16
+MAX_WAIT_MS = 10
+
+detect_queue = queue.Queue()
+
+def detect_worker():
+    while True:
+        batch = [detect_queue.get()]
+
+        # Wait briefly for more requests to coalesce into one batch
+        deadline = time.monotonic() + MAX_WAIT_MS / 1000.0
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(detect_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        images = [image for image, _ in batch]
+        try:
+            # Hand decoded arrays (or paths) to predict as a list:
+            # Ultralytics letterboxes each frame and fills in per-image
+            # orig_img/orig_shape, which raw 4-D tensor input does not
+            if yolo_available and len(images) > 1:
+                results = detector.model.predict(images, batch=len(images), half=True, verbose=False)
+            else:
+                results = [detector.detect(image) for image in images]
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+threading.Thread(target=detect_worker, daemon=True).start()
+
+# Keep recently uploaded images decoded in memory so /detect can skip
+# the disk round-trip and second JPEG decode
+IMAGE_CACHE_SIZE = 32
+image_cache = OrderedDict()
+image_cache_lock = threading.Lock()
+
+def cache_image(image_id, img):
+    with image_cache_lock:
+        image_cache[image_id] = img
+        image_cache.move_to_end(image_id)
+        while len(image_cache) > IMAGE_CACHE_SIZE:
+            image_cache.popitem(last=False)
+
+def get_cached_image(image_id):
+    with image_cache_lock:
+        return image_cache.get(image_id)
+
+def write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+# Move Supabase writes off the request path: handlers enqueue rows and
+# return immediately, a daemon thread drains the queue and batches
+# consecutive inserts into single RPCs
+write_queue = queue.Queue()
+
+# Deferred disk writes get their own queue and thread so /detect's disk
+# fallback never waits behind database round-trips
+file_queue = queue.Queue()
+
+def enqueue_insert(table, payload):
+    write_queue.put((table, 'insert', payload))
+
+def enqueue_file_write(path, data):
+    file_queue.put((path, data))
+
+def enqueue_detection(image_id, processed_url, corrosion_percentage, detection_data):
+    write_queue.put((None, 'record', (image_id, processed_url, corrosion_percentage, detection_data)))
+
+# Prefer the record_detection SQL function (one round-trip for the
+# update+insert pair); fall back to separate writes if it isn't installed
+detection_rpc_available = True
+
+def record_detection(image_id, processed_url, corrosion_percentage, detection_data):
+    global detection_rpc_available
+    if detection_rpc_available:
+        try:
+            db.rpc('record_detection', {
+                'p_image_id': image_id,
+                'p_processed_url': processed_url,
+                'p_percentage': corrosion_percentage,
+                'p_data': detection_data
+            }).execute()
+            return
+        except Exception as e:
+            detection_rpc_available = False
+            print(f"record_detection RPC unavailable, using separate writes: {e}")
+
+    db.table('images').update({
+        'processed_image_url': processed_url
+    }).eq('id', image_id).execute()
+    db.table('detections').insert({
+        'image_id': image_id,
+        'corrosion_percentage': corrosion_percentage,
+        'detection_data': detection_data
+    }).execute()
+
+def db_writer():
+    while True:
+        items = [write_queue.get()]
+        try:
+            while len(items) < 64:
+                items.append(write_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        inserts = {}
+        records = []
+        for table, op, payload in items:
+            if op == 'insert':
+                inserts.setdefault(table, []).append(payload)
+            elif op == 'record':
+                records.append(payload)
+
+        try:
+            for table, rows in inserts.items():
+                db.table(table).insert(rows if len(rows) > 1 else rows[0]).execute()
+            for payload in records:
+                record_detection(*payload)
+        except Exception as e:
+            print(f"Database error: {e}")
+
+def file_writer():
+    while True:
+        path, data = file_queue.get()
+        try:
+            write_file(path, data)
+        except OSError as e:
+            print(f"File write error: {e}")
+
+threading.Thread(target=db_writer, daemon=True).start()
+threading.Thread(target=file_writer, daemon=True).start()
 
 # Ensure folders exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -110,37 +306,105 @@ os.makedirs(app.config['PROCESSED_FOLDER'], exist_ok=True)
 def index():
     return render_template('index.html')
 
+if streaming_parser_available:
+    class HashingValueTarget(ValueTarget):
+        # Hash the content in the same pass that collects it
+        def __init__(self, hasher):
+            super().__init__()
+            self.hasher = hasher
+
+        def on_data_received(self, chunk):
+            super().on_data_received(chunk)
+            self.hasher.update(chunk)
+
+def read_upload():
+    """Pull the uploaded file out of the request, streaming the multipart
+    body in 64KiB chunks when streaming-form-data is installed instead of
+    going through werkzeug's parser. Returns the filename, the bytes, and
+    a content hash computed in the same pass."""
+    hasher = new_hasher()
+    if streaming_parser_available and 'multipart/form-data' in (request.content_type or ''):
+        parser = StreamingFormDataParser(headers=dict(request.headers))
+        target = HashingValueTarget(hasher)
+        parser.register('file', target)
+        while True:
+            chunk = request.stream.read(64 * 1024)
+            if not chunk:
+                break
+            parser.data_received(chunk)
+        return target.multipart_filename, target.value, hasher.hexdigest()
+
+    if 'file' not in request.files:
+        return None, b'', None
+    file = request.files['file']
+    data = file.read()
+    hasher.update(data)
+    return file.filename, data, hasher.hexdigest()
+
+# Remember recent uploads by content hash and recent detections by image
+# id so a duplicate upload skips decode+write and its /detect call
+# returns the already-computed result
+DEDUPE_CACHE_SIZE = 256
+upload_dedupe = OrderedDict()
+detection_dedupe = OrderedDict()
+dedupe_lock = threading.Lock()
+
+def remember(cache, key, value):
+    with dedupe_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > DEDUPE_CACHE_SIZE:
+            cache.popitem(last=False)
+
+def recall(cache, key):
+    with dedupe_lock:
+        return cache.get(key)
+
 @app.route('/upload', methods=['POST'])
 def upload_image():
-    if 'file' not in request.files:
+    upload_name, data, content_hash = read_upload()
+    if not upload_name:
         return jsonify({'error': 'No file uploaded'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
+    if not data:
         return jsonify({'error': 'No file selected'}), 400
-    
-    # Save original image
-    filename = secure_filename(file.filename)
-    unique_filename = f"{uuid.uuid4()}_{filename}"
+
+    # Same bytes as a previous upload: reuse its image outright
+    previous = recall(upload_dedupe, content_hash)
+    if previous is not None:
+        return jsonify(previous)
+
+    # Decode once in memory, persist to disk off the request path
+    filename = secure_filename(upload_name)
+    unique_filename = f"{new_id()}_{filename}"
     original_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-    file.save(original_path)
-    
-    # Store in database
-    try:
-        result = db.table('images').insert({
-            'filename': unique_filename,
-            'original_image_url': f"/uploads/{unique_filename}",
-        }).execute()
-        image_id = result.data[0]['id']
-    except Exception as e:
-        print(f"Database error: {e}")
-        image_id = str(uuid.uuid4())
-    
-    return jsonify({
+
+    img = None
+    if opencv_available:
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+    if img is not None:
+        enqueue_file_write(original_path, data)
+    else:
+        write_file(original_path, data)
+
+    # Store in database without blocking the response
+    image_id = new_id()
+    enqueue_insert('images', {
+        'id': image_id,
+        'filename': unique_filename,
+        'original_image_url': f"/uploads/{unique_filename}",
+    })
+
+    if img is not None:
+        cache_image(image_id, img)
+
+    response = {
         'image_id': image_id,
         'original_url': f"/uploads/{unique_filename}",
         'filename': unique_filename
-    })
+    }
+    remember(upload_dedupe, content_hash, response)
+    return jsonify(response)
 
 @app.route('/detect', methods=['POST'])
 def detect_corrosion():
@@ -150,17 +414,32 @@ def detect_corrosion():
     
     if not image_id or not filename:
         return jsonify({'error': 'Missing parameters'}), 400
-    
-    # Get original image path
+
+    # Duplicate content resolves to the same image id, so a repeat
+    # detection can return the stored result without touching the GPU
+    previous = recall(detection_dedupe, image_id)
+    if previous is not None:
+        return jsonify(previous)
+
+    # Use the in-memory image if we still have it, otherwise fall back to disk
     original_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    
-    # Perform detection
-    result = detector.detect(original_path)
+    image = get_cached_image(image_id) if yolo_available else None
+    if image is None:
+        image = original_path
+
+    # Perform detection through the batching worker
+    future = Future()
+    detect_queue.put((image, future))
+    result = future.result(timeout=60)
     processed_filename = f"processed_{filename}"
     processed_path = os.path.join(app.config['PROCESSED_FOLDER'], processed_filename)
     
-    # Save processed image
-    result.save(processed_path)
+    # Save the annotated image. Results has no save() on this
+    # ultralytics pin; plot() renders the detections onto the frame
+    if hasattr(result, 'plot'):
+        cv2.imwrite(processed_path, result.plot())
+    else:
+        result.save(processed_path)
     
     # Calculate corrosion percentage
     corrosion_percentage = detector.calculate_corrosion_percentage(result)
@@ -171,24 +450,16 @@ def detect_corrosion():
         'corrosion_percentage': corrosion_percentage
     }
     
-    try:
-        db.table('images').update({
-            'processed_image_url': f"/processed/{processed_filename}",
-        }).eq('id', image_id).execute()
-        
-        db.table('detections').insert({
-            'image_id': image_id,
-            'corrosion_percentage': corrosion_percentage,
-            'detection_data': detection_data
-        }).execute()
-    except Exception as e:
-        print(f"Database error: {e}")
-    
-    return jsonify({
+    enqueue_detection(image_id, f"/processed/{processed_filename}",
+                      corrosion_percentage, detection_data)
+
+    response = {
         'processed_url': f"/processed/{processed_filename}",
         'corrosion_percentage': corrosion_percentage,
         'detection_data': detection_data
-    })
+    }
+    remember(detection_dedupe, image_id, response)
+    return jsonify(response)
 
 @app.route('/comment', methods=['POST'])
 def add_comment():
@@ -199,28 +470,36 @@ def add_comment():
     if not image_id or not comment_text:
         return jsonify({'error': 'Missing parameters'}), 400
     
-    # Store comment
-    try:
-        result = db.table('comments').insert({
-            'image_id': image_id,
-            'comment_text': comment_text
-        }).execute()
-        comment_id = result.data[0]['id']
-    except Exception as e:
-        print(f"Database error: {e}")
-        comment_id = str(uuid.uuid4())
-    
+    # Store comment without blocking the response
+    comment_id = new_id()
+    enqueue_insert('comments', {
+        'id': comment_id,
+        'image_id': image_id,
+        'comment_text': comment_text
+    })
+
     return jsonify({
         'comment_id': comment_id,
         'message': 'Comment added successfully'
     })
 
+# Short TTL cache so bursts of history views hit Supabase once
+HISTORY_TTL = 10
+history_cache = {'data': None, 'expires': 0.0}
+
 @app.route('/history')
 def get_history():
+    now = time.monotonic()
+    if history_cache['data'] is not None and now < history_cache['expires']:
+        return jsonify(history_cache['data'])
+
     # Return mock data for demonstration
     try:
         result = db.table('images').select('*').execute()
-        return jsonify(result.data if hasattr(result, 'data') else [])
+        data = result.data if hasattr(result, 'data') else []
+        history_cache['data'] = data
+        history_cache['expires'] = now + HISTORY_TTL
+        return jsonify(data)
     except Exception as e:
         print(f"Database error: {e}")
         # Return mock data if database is not available
@@ -235,13 +514,37 @@ def get_history():
         ]
         return jsonify(mock_history)
 
+@lru_cache(maxsize=128)
+def read_image_file(path, mtime):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def serve_image(folder, filename):
+    path = os.path.join(folder, secure_filename(filename))
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return jsonify({'error': 'File not found'}), 404
+
+    # Filenames are UUID-prefixed and never rewritten, so clients and
+    # the in-memory LRU can both cache aggressively
+    etag = f"{int(mtime * 1000000):x}"
+    if request.if_none_match.contains(etag):
+        return Response(status=304)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'image/jpeg'
+    response = Response(read_image_file(path, mtime), mimetype=mimetype)
+    response.headers['Cache-Control'] = 'public, max-age=3600, immutable'
+    response.set_etag(etag)
+    return response
+
 @app.route('/uploads/<filename>')
 def serve_uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return serve_image(app.config['UPLOAD_FOLDER'], filename)
 
 @app.route('/processed/<filename>')
 def serve_processed_file(filename):
-    return send_from_directory(app.config['PROCESSED_FOLDER'], filename)
+    return serve_image(app.config['PROCESSED_FOLDER'], filename)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -2,9 +2,9 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from PIL import Image
 import tempfile
 import os
+import shutil
 import uuid
 from datetime import datetime
 
@@ -13,6 +13,7 @@ try:
     from utils.detection import CorrosionDetector
     from utils.database import SupabaseDB
     from utils.helpers import save_image, generate_presigned_url
+    import cv2
 except ImportError:
     st.warning("Some components couldn't be imported. Using mock implementations.")
     
@@ -28,7 +29,6 @@ except ImportError:
                     self.path = image_path
                 
                 def save(self, path):
-                    import shutil
                     shutil.copy2(self.path, path)
             
             return MockResult()
@@ -84,10 +84,8 @@ except ImportError:
 # Initialize components
 @st.cache_resource
 def load_detector():
-    try:
-        return CorrosionDetector('best.pt')
-    except:
-        return CorrosionDetector('best.pt')  # This will use the mock
+    # CorrosionDetector warms the model itself at construction time
+    return CorrosionDetector('best.pt')
 
 @st.cache_resource
 def load_database():
@@ -101,6 +99,24 @@ def load_database():
 detector = load_detector()
 db = load_database()
 
+@st.cache_data(ttl=10)
+def load_history():
+    return db.get_all_images()
+
+@st.cache_data(ttl=30)
+def build_dashboard_frame(history):
+    # Build the frame columnar in one shot instead of looping over rows
+    df = pd.DataFrame.from_records(history, columns=['filename', 'uploaded_at', 'corrosion_percentage'])
+    df = df.dropna(subset=['corrosion_percentage'])
+    df['uploaded_at'] = pd.to_datetime(df['uploaded_at'], format='ISO8601', errors='coerce')
+    df['filename'] = df['filename'].astype('category')
+    df = df.sort_values('uploaded_at')
+    return df.rename(columns={
+        'filename': 'Filename',
+        'uploaded_at': 'Date',
+        'corrosion_percentage': 'Corrosion (%)'
+    })
+
 # Streamlit app layout
 st.set_page_config(
     page_title="Corrosion AI Detector",
@@ -123,12 +139,13 @@ if app_mode == "Upload Image":
     
     if uploaded_file is not None:
         # Display original image
-        image = Image.open(uploaded_file)
-        st.image(image, caption="Original Image", use_column_width=True)
-        
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-            image.save(tmp_file.name)
+        raw = uploaded_file.getvalue()
+        st.image(raw, caption="Original Image", use_column_width=True)
+
+        # Write the original bytes as-is - no decode/re-encode cycle
+        ext = uploaded_file.name.rsplit('.', 1)[-1].lower()
+        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{ext}") as tmp_file:
+            tmp_file.write(raw)
             tmp_path = tmp_file.name
         
         # Process image when button is clicked
@@ -141,7 +158,11 @@ if app_mode == "Upload Image":
                 processed_filename = f"processed_{uploaded_file.name}"
                 processed_path = os.path.join("processed", processed_filename)
                 os.makedirs("processed", exist_ok=True)
-                result.save(processed_path)
+                # Results has no save() on this ultralytics pin
+                if hasattr(result, 'plot'):
+                    cv2.imwrite(processed_path, result.plot())
+                else:
+                    result.save(processed_path)
                 
                 # Calculate corrosion percentage
                 corrosion_percentage = detector.calculate_corrosion_percentage(result)
@@ -165,6 +186,7 @@ if app_mode == "Upload Image":
                     image_id = db.insert_image(uploaded_file.name, tmp_path)
                     db.update_image_processed(image_id, processed_path)
                     db.insert_detection(image_id, corrosion_percentage, {"percentage": corrosion_percentage})
+                    load_history.clear()
                     
                     st.success("Results saved to database!")
                 except Exception as e:
@@ -185,7 +207,7 @@ elif app_mode == "View History":
     st.header("Detection History")
     
     try:
-        history = db.get_all_images()
+        history = load_history()
         
         if history:
             for item in history:
@@ -234,29 +256,12 @@ elif app_mode == "Analysis Dashboard":
     st.header("Corrosion Analysis Dashboard")
     
     try:
-        history = db.get_all_images()
+        history = load_history()
         
         if history:
-            # Create a dataframe for analysis
-            df_data = []
-            for item in history:
-                if item.get('corrosion_percentage') is not None:
-                    df_data.append({
-                        'Filename': item['filename'],
-                        'Date': item.get('uploaded_at', ''),
-                        'Corrosion (%)': item['corrosion_percentage']
-                    })
-            
-            if df_data:
-                df = pd.DataFrame(df_data)
-                
-                # Convert date strings to datetime objects
-                try:
-                    df['Date'] = pd.to_datetime(df['Date'])
-                    df = df.sort_values('Date')
-                except:
-                    pass
-                
+            df = build_dashboard_frame(history)
+
+            if not df.empty:
                 # Show data table
                 st.subheader("Detection Data")
                 st.dataframe(df)
@@ -0,0 +1,17 @@
+-- Combine the processed-image update and the detection insert into a
+-- single server-side call so /detect costs one network round-trip.
+create or replace function record_detection(
+    p_image_id uuid,
+    p_processed_url text,
+    p_percentage real,
+    p_data jsonb
+) returns void as $$
+begin
+    update images
+    set processed_image_url = p_processed_url
+    where id = p_image_id;
+
+    insert into detections (image_id, corrosion_percentage, detection_data)
+    values (p_image_id, p_percentage, p_data);
+end;
+$$ language plpgsql;
@@ -1,7 +1,11 @@
 # utils/database.py
 from supabase import create_client, Client
+from cachetools import TTLCache, cached
 import json
 
+# Collapse bursts of history reads into one Supabase round-trip
+_images_cache = TTLCache(maxsize=1, ttl=10)
+
 class SupabaseDB:
     def __init__(self, supabase_url: str, supabase_key: str):
         self.supabase: Client = create_client(supabase_url, supabase_key)
@@ -12,12 +16,14 @@ class SupabaseDB:
             'original_image_url': original_url
         }
         result = self.supabase.table('images').insert(data).execute()
+        _images_cache.clear()
         return result.data[0]['id'] if result.data else None
-    
+
     def update_image_processed(self, image_id: str, processed_url: str):
         self.supabase.table('images').update({
             'processed_image_url': processed_url
         }).eq('id', image_id).execute()
+        _images_cache.clear()
     
     def insert_detection(self, image_id: str, corrosion_percentage: float, detection_data: dict):
         data = {
@@ -36,6 +42,7 @@ class SupabaseDB:
         result = self.supabase.table('comments').insert(data).execute()
         return result.data[0]['id'] if result.data else None
     
+    @cached(_images_cache)
     def get_all_images(self):
         result = self.supabase.table('images').select('*').order('uploaded_at', desc=True).execute()
         return result.data if result.data else []
@@ -1,30 +1,264 @@
 # utils/detection.py
+import os
+
+# Leave half the cores for I/O work (uploads, the DB writer) instead of
+# letting the numeric libraries claim one thread per core; must be set
+# before torch is imported
+_COMPUTE_THREADS = max(1, (os.cpu_count() or 2) // 2)
+os.environ.setdefault('OMP_NUM_THREADS', str(_COMPUTE_THREADS))
+
 from ultralytics import YOLO
+from PIL import Image
 import cv2
 import numpy as np
+import torch
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# OpenCV only does decode/resize here - one thread avoids contending
+# with the model's worker pool
+cv2.setNumThreads(1)
+torch.set_num_threads(_COMPUTE_THREADS)
+
+# Prefer libjpeg-turbo's SIMD decoder for the fallback path
+try:
+    from turbojpeg import TurboJPEG
+    _turbojpeg = TurboJPEG()
+except Exception:
+    _turbojpeg = None
+
+# Maximum batch size baked into the exported TensorRT engine
+MAX_BATCH = 16
+
+# Input resolution the model runs at
+IMGSZ = 640
+
+# One long-lived worker holds the warm GPU context; async callers hand
+# work to it instead of blocking the event loop on inference
+_detect_pool = ThreadPoolExecutor(max_workers=1)
+
+def _image_size(path: str):
+    """Return (height, width) for an image on disk.
+
+    Only the dimensions are needed, so a libjpeg-turbo header parse -
+    no pixel decode at all - beats a full cv2.imread by orders of
+    magnitude when PyTurboJPEG is installed.
+    """
+    if _turbojpeg is not None:
+        try:
+            with open(path, 'rb') as f:
+                width, height, _, _ = _turbojpeg.decode_header(f.read())
+            return height, width
+        except Exception:
+            pass
+
+    img = cv2.imread(path)
+    return img.shape[:2]
+
+def _box_area_sum(xyxy):
+    # Sub-sub-mul-sum over the boxes tensor; torch.compile fuses the
+    # intermediates into one kernel (first call compiles, absorbed by
+    # the model warmup)
+    return ((xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])).sum()
+
+if hasattr(torch, 'compile'):
+    try:
+        _box_area_sum = torch.compile(_box_area_sum, mode='reduce-overhead')
+    except Exception:
+        pass
+
+def _export_engine(model_path: str, engine_path: str, **precision):
+    """Export weights to a TensorRT engine at the given path and load it.
+
+    Returns None when export isn't possible (e.g. no GPU/TensorRT, or no
+    calibration data for INT8).
+    """
+    # Note: NMS stays in Python here. On the pinned ultralytics
+    # (8.0.143) the export nms flag is CoreML-only, so the engine can't
+    # bake in EfficientNMS without a dependency bump
+    if not os.path.exists(engine_path):
+        try:
+            exported = YOLO(model_path).export(
+                format='engine',
+                imgsz=640,
+                dynamic=True,
+                batch=MAX_BATCH,
+                workspace=4,
+                **precision
+            )
+            if exported and exported != engine_path:
+                os.replace(exported, engine_path)
+        except Exception as e:
+            print(f"TensorRT export failed ({precision}): {e}")
+            return None
+
+    return YOLO(engine_path)
+
+def _export_onnx(model_path: str, onnx_path: str):
+    """CPU fallback when TensorRT isn't available: ONNXRuntime still
+    fuses the graph and beats eager PyTorch."""
+    if not os.path.exists(onnx_path):
+        try:
+            YOLO(model_path).export(format='onnx', imgsz=640, dynamic=True)
+        except Exception as e:
+            print(f"ONNX export failed: {e}")
+            return None
+
+    return YOLO(onnx_path)
+
+@functools.lru_cache(maxsize=None)
+def load_model(model_path: str):
+    """Load the YOLO model, preferring a TensorRT engine.
+
+    Exports the .pt weights on first use and loads the engine on
+    subsequent startups. Set DETECTOR_PRECISION=int8 to build an
+    INT8-calibrated engine (needs calib.yaml next to the weights);
+    otherwise an FP16 engine is used. Falls back to the original
+    weights if export isn't possible.
+    """
+    base, ext = os.path.splitext(model_path)
+    if ext != '.pt':
+        return YOLO(model_path)
+
+    if os.getenv('DETECTOR_PRECISION', 'fp16').lower() == 'int8':
+        model = _export_engine(model_path, base + '-int8.engine', int8=True, data='calib.yaml')
+        if model is not None:
+            return model
+        print("INT8 engine unavailable, falling back to FP16")
+
+    model = _export_engine(model_path, base + '.engine', half=True)
+    if model is not None:
+        return model
+
+    model = _export_onnx(model_path, base + '.onnx')
+    if model is not None:
+        return model
+
+    print("Using PyTorch weights")
+    return YOLO(model_path)
 
 class CorrosionDetector:
-    def __init__(self, model_path: str):
-        self.model = YOLO(model_path)
+    """Thin wrapper around a shared YOLO model.
+
+    Detectors constructed with the same weights path reuse one backing
+    model via load_model's cache, so extra instances cost no additional
+    weight loads or VRAM. Safe because inference is read-only on the
+    weights.
+    """
+
+    def __init__(self, model_path: str, warmup: bool = True):
+        self.model = load_model(model_path)
+        if warmup:
+            # Two dummy passes absorb CUDA context init, cuDNN autotune,
+            # and engine profile selection so the first real detect()
+            # call runs at steady-state speed
+            dummy = np.zeros((640, 640, 3), dtype=np.uint8)
+            self.model(dummy, verbose=False)
+            self.model(dummy, verbose=False)
     
-    def detect(self, image_path: str):
-        results = self.model(image_path)
+    @staticmethod
+    def _read_image(path: str):
+        # Pillow reads just the header, so we can pick a reduced decode
+        # flag for oversized inputs - IMREAD_REDUCED_COLOR_* shrinks the
+        # JPEG decode itself, not just the resize afterwards. The model
+        # letterboxes to IMGSZ anyway and the corrosion percentage is
+        # scale-invariant, so nothing downstream needs rescaling
+        flag = cv2.IMREAD_COLOR
+        try:
+            with Image.open(path) as header:
+                width, height = header.size
+            smaller = min(width, height)
+            if smaller >= IMGSZ * 8:
+                flag = cv2.IMREAD_REDUCED_COLOR_8
+            elif smaller >= IMGSZ * 4:
+                flag = cv2.IMREAD_REDUCED_COLOR_4
+            elif smaller >= IMGSZ * 2:
+                flag = cv2.IMREAD_REDUCED_COLOR_2
+        except Exception:
+            pass
+        return cv2.imread(path, flag)
+
+    def detect(self, image):
+        # Accept a decoded frame or a path; decoding the path here means
+        # the JPEG is read exactly once, and result.orig_img keeps a
+        # reference to the array for any downstream use
+        if isinstance(image, str):
+            decoded = self._read_image(image)
+            if decoded is not None:
+                image = decoded
+        results = self.model(image, imgsz=IMGSZ, half=True)
         return results[0]  # Return first result
+
+    def detect_batch(self, image_paths, batch: int = MAX_BATCH):
+        # One call amortizes preprocessing and kernel launches across the
+        # whole list; stream=True avoids holding every result at once
+        return list(self.model(image_paths, stream=True, batch=batch, half=True))
+
+    def detect_video(self, video_path: str, sample_fps: float = 2.0):
+        """Yield detection results for frames sampled at sample_fps.
+
+        grab() advances the stream without decoding, so only the sampled
+        frames pay for a full retrieve() decode.
+        """
+        cap = cv2.VideoCapture(video_path)
+        try:
+            src_fps = cap.get(cv2.CAP_PROP_FPS) or sample_fps
+            stride = max(1, int(src_fps / sample_fps))
+            i = 0
+            while cap.grab():
+                if i % stride == 0:
+                    ok, frame = cap.retrieve()
+                    if ok:
+                        yield self.model(frame, imgsz=IMGSZ, half=True)[0]
+                i += 1
+        finally:
+            cap.release()
+
+    async def detect_async(self, image):
+        # Lets callers overlap image I/O and storage uploads with
+        # GPU compute instead of serializing them
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_detect_pool, self.detect, image)
     
     def calculate_corrosion_percentage(self, result):
-        if not result.boxes:
+        # Segmentation models: union the mask stack and reduce in a
+        # single kernel instead of looping in Python
+        if getattr(result, 'masks', None) is not None:
+            return result.masks.data.any(0).float().mean().mul_(100).item()
+
+        # len() is unambiguous for tensor-backed box containers (truth
+        # testing can raise) and returns before any image access
+        if result.boxes is None or len(result.boxes) == 0:
             return 0.0
-        
-        # Get image dimensions
-        img = cv2.imread(result.path)
-        height, width = img.shape[:2]
-        total_pixels = height * width
-        
-        # Calculate area of all detections
-        corrosion_pixels = 0
-        for box in result.boxes:
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-            corrosion_pixels += (x2 - x1) * (y2 - y1)
-        
+
+        # Ultralytics already knows the original dimensions - don't
+        # decode the image a second time just for its shape
+        if getattr(result, 'orig_shape', None) is not None:
+            height, width = result.orig_shape[:2]
+        else:
+            height, width = _image_size(result.path)
+
+        # A single box can't overlap anything, so skip the mask and take
+        # the fused area computation straight off the device tensor
+        if len(result.boxes) == 1:
+            return _box_area_sum(result.boxes.xyxy).item() / (height * width) * 100
+
+        # Rasterize the boxes into a downsampled mask so overlapping
+        # detections aren't double-counted (summed areas can report more
+        # than 100% corrosion). The percentage is scale-invariant, so a
+        # quarter-resolution canvas costs 16x less memory
+        scale = 4
+        mask = np.zeros((max(1, height // scale), max(1, width // scale)), dtype=np.uint8)
+        # Scale on the device, then sync once for the whole tensor -
+        # never per box, which would stall the GPU pipeline on a memcpy
+        # for every detection. Floor the near corner and ceil the far
+        # one so boxes smaller than `scale` pixels still cover a cell
+        # instead of truncating to zero area
+        boxes = result.boxes.xyxy.div(scale)
+        corners = torch.cat((boxes[:, :2].floor(), boxes[:, 2:].ceil()), dim=1).int().cpu().numpy()
+        for x1, y1, x2, y2 in corners:
+            mask[y1:max(y2, y1 + 1), x1:max(x2, x1 + 1)] = 1
+
         # Return percentage
-        return (corrosion_pixels / total_pixels) * 100
\ No newline at end of file
+        return float(mask.mean()) * 100
\ No newline at end of file
@@ -1,32 +1,74 @@
 # utils/helpers.py
 from supabase import create_client, Client
 import os
-from datetime import datetime, timedelta
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+
+# Signed URLs are valid for an hour; reuse them until ~80% of that has
+# elapsed so repeated views of the same image skip the signing RPC
+_url_cache = TTLCache(maxsize=4096, ttl=3000)
+
+# Uploads are network-bound, so a small pool makes N files cost the
+# slowest transfer instead of the sum
+_upload_pool = ThreadPoolExecutor(max_workers=8)
+
+# Build the client once and reuse it - construction parses the URL and
+# sets up a fresh HTTP session, and a shared client keeps its TCP+TLS
+# connections alive across calls
+_supabase = None
+
+def _client() -> Client:
+    global _supabase
+    if _supabase is None:
+        _supabase = create_client(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_KEY'))
+    return _supabase
 
 def save_image(image_path: str, storage_path: str):
-    supabase_url = os.getenv('SUPABASE_URL')
-    supabase_key = os.getenv('SUPABASE_KEY')
-    supabase: Client = create_client(supabase_url, supabase_key)
-    
-    with open(image_path, 'rb') as f:
-        supabase.storage.from_('corrosion-images').upload(
-            file=f.read(),
-            path=storage_path,
-            file_options={"content-type": "image/jpeg"}
-        )
-    
-    return generate_presigned_url(storage_path)
+    supabase = _client()
+
+    # The SDK accepts a path and streams the file in chunks, so don't
+    # load the whole image into memory first
+    supabase.storage.from_('corrosion-images').upload(
+        file=image_path,
+        path=storage_path,
+        file_options={"content-type": "image/jpeg"}
+    )
+
+    # Sign on the same client while its connection is warm instead of
+    # bouncing through generate_presigned_url. create_signed_url takes a
+    # lifetime in seconds and returns a plain dict
+    response = supabase.storage.from_('corrosion-images').create_signed_url(
+        storage_path, 3600
+    )
+
+    url = response["signedURL"]
+    _url_cache[storage_path] = url
+    return url
+
+def save_images(items):
+    """Upload (image_path, storage_path) pairs concurrently on the shared
+    client and return their signed URLs in input order."""
+    futures = [_upload_pool.submit(save_image, image_path, storage_path)
+               for image_path, storage_path in items]
+    return [future.result() for future in futures]
+
+def create_signed_upload_url(storage_path: str):
+    # Preferred for large files: the client PUTs straight to storage,
+    # so the server only signs the URL and never touches the bytes
+    return _client().storage.from_('corrosion-images').create_signed_upload_url(storage_path)
 
 def generate_presigned_url(storage_path: str):
-    supabase_url = os.getenv('SUPABASE_URL')
-    supabase_key = os.getenv('SUPABASE_KEY')
-    supabase: Client = create_client(supabase_url, supabase_key)
-    
+    cached = _url_cache.get(storage_path)
+    if cached is not None:
+        return cached
+
+    supabase = _client()
+
     # Generate signed URL that's valid for 1 hour
-    expiration = int((datetime.now() + timedelta(hours=1)).timestamp())
-    
     response = supabase.storage.from_('corrosion-images').create_signed_url(
-        storage_path, expiration
+        storage_path, 3600
     )
-    
-    return response.signed_url
\ No newline at end of file
+
+    url = response["signedURL"]
+    _url_cache[storage_path] = url
+    return url
\ No newline at end of file